@@ -6,6 +6,7 @@ from typing import Optional
 import os
 from dotenv import load_dotenv
 from database.configs import connection
+from memory_store import create_store
 
 load_dotenv()
 
@@ -14,6 +15,12 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Comma separated user ids allowed to use the /admin endpoints
+ADMIN_USER_IDS = {uid.strip() for uid in os.getenv("ADMIN_USER_IDS", "").split(",") if uid.strip()}
+
+# Short-lived cache of user rows so every authenticated request doesn't hit the DB
+user_cache = create_store("users", budget_bytes=2 * 1024 * 1024, ttl_seconds=60)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -45,6 +52,10 @@ async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)):
         print(f"JWT decode error: {str(e)}")
         raise credentials_exception
 
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return cached_user
+
     try:
         with connection.cursor() as cursor:
             cursor.execute(
@@ -59,10 +70,25 @@ async def get_current_user(token: Optional[str] = Depends(oauth2_scheme)):
             if user is None:
                 print(f"User not found for id: {user_id}")
                 raise credentials_exception
+            user_cache.set(user_id, user)
             return user
     except Exception as e:
         print(f"Database error in get_current_user: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail="Error fetching user data"
-        ) 
\ No newline at end of file
+        )
+
+async def require_admin(current_user: Optional[dict] = Depends(get_current_user)):
+    if current_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    if str(current_user['id']) not in ADMIN_USER_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from openai import OpenAI
 import requests
@@ -9,8 +10,13 @@ from dotenv import load_dotenv
 from auth.routes import router as auth_router
 import openai
 from rate_limit import check_rate_limit
-from auth.utils import get_current_user
+from auth.utils import get_current_user, require_admin
+from memory_store import create_store, coordinator
+from profiling import profiler, to_folded, to_speedscope, PROFILE_MAX_SECONDS
+from specs import normalize_product, get_cached_product, diff_products, diff_to_prompt
 from typing import Optional
+import hashlib
+import asyncio
 
 # Load environment variables from .env file
 try:
@@ -43,6 +49,35 @@ client = OpenAI(api_key=api_key)
 # Include auth routes
 app.include_router(auth_router, prefix="/auth", tags=["auth"])
 
+# In-process caches, each bounded by a byte budget (see memory_store.py)
+search_cache = create_store("search", budget_bytes=32 * 1024 * 1024, ttl_seconds=300)
+product_cache = create_store("products", budget_bytes=32 * 1024 * 1024, ttl_seconds=600)
+comparison_cache = create_store("comparisons", budget_bytes=8 * 1024 * 1024, ttl_seconds=3600)
+
+@app.on_event("startup")
+async def record_memory_baseline():
+    coordinator.record_baseline()
+
+@app.on_event("startup")
+async def start_profiler():
+    profiler.start()
+
+@app.on_event("shutdown")
+async def stop_profiler():
+    profiler.stop()
+
+# Sample a fraction of requests with the statistical profiler
+@app.middleware("http")
+async def sample_requests(request, call_next):
+    if not profiler.should_sample():
+        return await call_next(request)
+
+    profiler.request_started()
+    try:
+        return await call_next(request)
+    finally:
+        profiler.request_finished()
+
 @app.middleware("http")
 async def add_cors_headers(request, call_next):
     response = await call_next(request)
@@ -65,6 +100,10 @@ async def search_products(query: str):
     if not query:
         raise HTTPException(status_code=400, detail="Query parameter is required")
 
+    cached = search_cache.get_bytes(query)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
     try:
         # Call Tiki API
         tiki_api_url = f"https://tiki.vn/api/v2/products?limit=100&include=advertisement&aggregations=2&q={query}"
@@ -92,22 +131,42 @@ async def search_products(query: str):
             for product in products
         ]
 
+        search_cache.set(query, result)
         return result
 
     except requests.RequestException as e:
         raise HTTPException(status_code=500, detail=f"Error fetching data from Tiki: {str(e)}")
     
+def fetch_tiki_product(product_id: int):
+    tiki_api_url = f"https://tiki.vn/api/v2/products/{product_id}?platform=web&spid={product_id}&version=3"
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36"
+    }
+    response = requests.get(tiki_api_url, headers=headers, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+def load_normalized_product(product_id: int):
+    record = get_cached_product(product_id)
+    if record is None:
+        record = normalize_product(product_id, fetch_tiki_product(product_id))
+    return record
+
 @app.get("/product/{product_id}")
 async def get_product_details(product_id: int):
+    cached = product_cache.get_bytes(str(product_id))
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
     try:
-        tiki_api_url = f"https://tiki.vn/api/v2/products/{product_id}?platform=web&spid={product_id}&version=3"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36"
-        }
-        response = requests.get(tiki_api_url, headers=headers)
-        response.raise_for_status()
+        data = fetch_tiki_product(product_id)
 
-        data = response.json()
+        # Parse specs once here so later diffs hit the cache. This is only
+        # a cache warm-up, it must never break the details response.
+        try:
+            normalize_product(product_id, data)
+        except Exception as e:
+            print(f"Could not normalize specs for product {product_id}: {str(e)}")
 
         # Extract required fields
         result = {
@@ -117,6 +176,7 @@ async def get_product_details(product_id: int):
             "specifications": data.get("specifications", [])
         }
 
+        product_cache.set(str(product_id), result)
         return result
 
     except requests.RequestException as e:
@@ -175,6 +235,18 @@ async def compare_products(
             )
         
         print(f"Received comparison request with prompt length: {len(request.prompt)}")
+
+        rate_limit_info = {
+            "remaining_attempts": remaining_attempts,
+            "max_attempts": max_attempts,
+            "is_guest": is_guest
+        }
+
+        # Identical prompts get the same answer, no need to ask OpenAI again
+        prompt_key = hashlib.sha256(request.prompt.encode("utf-8")).hexdigest()
+        cached_comparison = comparison_cache.get(prompt_key)
+        if cached_comparison is not None:
+            return {"comparison": cached_comparison, "rate_limit": rate_limit_info}
         
         # Call OpenAI API
         response = client.responses.create(
@@ -195,14 +267,11 @@ async def compare_products(
             raise Exception("Invalid response from OpenAI API")
         
         comparison_text = response.choices[0].message.content
+        comparison_cache.set(prompt_key, comparison_text)
         
         return {
             "comparison": comparison_text,
-            "rate_limit": {
-                "remaining_attempts": remaining_attempts,
-                "max_attempts": max_attempts,
-                "is_guest": is_guest
-            }
+            "rate_limit": rate_limit_info
         }
     except HTTPException as e:
         raise e
@@ -210,5 +279,88 @@ async def compare_products(
         print(f"Unexpected error in compare endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting comparison: {str(e)}")
 
+# Attributes that differ between products, from their normalized specs
+@app.get("/compare/diff")
+async def diff_compared_products(ids: str):
+    try:
+        product_ids = list(dict.fromkeys(int(pid) for pid in ids.split(",") if pid.strip()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of product ids")
+    if len(product_ids) < 2 or len(product_ids) > 10:
+        raise HTTPException(status_code=400, detail="Provide between 2 and 10 product ids")
+
+    try:
+        # Fetch uncached products in parallel, off the event loop
+        records = await asyncio.gather(*[
+            run_in_threadpool(load_normalized_product, product_id)
+            for product_id in product_ids
+        ])
+
+        diff = diff_products(records)
+        diff["prompt"] = diff_to_prompt(diff)
+        return diff
+
+    except requests.RequestException as e:
+        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 404:
+            raise HTTPException(status_code=404, detail="Product not found on Tiki")
+        raise HTTPException(status_code=500, detail=f"Error fetching product details from Tiki: {str(e)}")
+
+# Memory usage of every in-process store, for sizing instances
+@app.get("/admin/memory")
+async def get_memory_stats(admin_user: dict = Depends(require_admin)):
+    return coordinator.stats()
+
+# Event loop lag, slow callbacks and sampling counters
+@app.get("/admin/profile/stats")
+async def get_profile_stats(admin_user: dict = Depends(require_admin)):
+    return profiler.stats()
+
+# Stacks collected from sampled requests since the last reset
+@app.get("/admin/profile/samples")
+async def get_profile_samples(
+    format: str = "folded",
+    reset: bool = False,
+    admin_user: dict = Depends(require_admin)
+):
+    # Validate before take_samples so a bad request can't throw away the samples
+    if format not in ("speedscope", "folded"):
+        raise HTTPException(status_code=400, detail="format must be 'speedscope' or 'folded'")
+
+    stacks = profiler.take_samples(reset=reset)
+    return _profile_response(stacks, format, "sampled-requests")
+
+# Profile everything the event loop does for the next `seconds`
+@app.post("/admin/profile")
+async def run_profile(
+    seconds: float = 10,
+    format: str = "speedscope",
+    admin_user: dict = Depends(require_admin)
+):
+    if seconds <= 0 or seconds > PROFILE_MAX_SECONDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}"
+        )
+    if format not in ("speedscope", "folded"):
+        raise HTTPException(status_code=400, detail="format must be 'speedscope' or 'folded'")
+
+    stacks = await profiler.capture(seconds)
+    return _profile_response(stacks, format, f"capture-{seconds:g}s")
+
+def _profile_response(stacks: dict, format: str, name: str):
+    if format == "folded":
+        # Feed to flamegraph.pl or https://www.speedscope.app to get a flame graph
+        return Response(
+            content=to_folded(stacks),
+            media_type="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="{name}.folded"'}
+        )
+    if format == "speedscope":
+        return JSONResponse(
+            content=to_speedscope(stacks, profiler.interval, name),
+            headers={"Content-Disposition": f'attachment; filename="{name}.speedscope.json"'}
+        )
+    raise HTTPException(status_code=400, detail="format must be 'speedscope' or 'folded'")
+
 # Note: For Render, use the following start command:
 # uvicorn backend.main:app --host 0.0.0.0 --port $PORT
\ No newline at end of file
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Memory settings
+# Each store gets a byte budget; the coordinator keeps the sum of all stores
+# (and, when it can be read, the process RSS) under MEMORY_TARGET_BYTES.
+MEMORY_TARGET_BYTES = int(os.getenv("MEMORY_TARGET_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_STORE_BUDGET_BYTES = int(os.getenv("DEFAULT_STORE_BUDGET_BYTES", str(16 * 1024 * 1024)))
+RSS_CHECK_INTERVAL_SECONDS = 1.0
+
+# Rough per-entry bookkeeping cost (OrderedDict slot, key string, _Entry object)
+ENTRY_OVERHEAD_BYTES = 120
+
+
+class _Entry:
+    __slots__ = ("data", "expires_at", "size")
+
+    def __init__(self, data: bytes, expires_at: Optional[float], size: int):
+        self.data = data
+        self.expires_at = expires_at
+        self.size = size
+
+
+def _read_rss_bytes():
+    """Current resident set size of this process, or None if unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MemoryStore:
+    """
+    LRU key/value store bounded by a byte budget instead of an entry count.
+    Values are kept as pre-serialized JSON bytes so their size is exact and
+    no live Python object graph is retained per entry.
+    """
+
+    def __init__(self, name: str, budget_bytes: int, ttl_seconds: Optional[float] = None):
+        self.name = name
+        self.budget_bytes = budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_bytes(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at is not None and entry.expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.data
+
+    def get(self, key: str):
+        data = self.get_bytes(key)
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def set_bytes(self, key: str, data: bytes, ttl_seconds: Optional[float] = None):
+        size = len(data) + len(key) + ENTRY_OVERHEAD_BYTES
+        if size > self.budget_bytes:
+            # Never let a single oversized value flush the whole store
+            return False
+
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(data, expires_at, size)
+            self.used_bytes += size
+            self._shrink_to(self.budget_bytes)
+
+        coordinator.enforce()
+        return True
+
+    def set(self, key: str, value, ttl_seconds: Optional[float] = None):
+        data = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        return self.set_bytes(key, data, ttl_seconds)
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def evict_bytes(self, amount: int):
+        """Evict least recently used entries until `amount` bytes are freed. Returns bytes freed."""
+        with self._lock:
+            before = self.used_bytes
+            self._shrink_to(max(self.used_bytes - amount, 0))
+            return before - self.used_bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "used_bytes": self.used_bytes,
+                "budget_bytes": self.budget_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Callers must hold self._lock
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.used_bytes -= entry.size
+
+    def _shrink_to(self, limit: int):
+        while self._entries and self.used_bytes > limit:
+            _, entry = self._entries.popitem(last=False)
+            self.used_bytes -= entry.size
+            self.evictions += 1
+
+
+class EvictionCoordinator:
+    """
+    Keeps every registered store within the global memory target.
+    Stores that are fullest relative to their own budget are trimmed first.
+    """
+
+    def __init__(self, target_bytes: int):
+        self.target_bytes = target_bytes
+        self.stores = {}
+        self.forced_evictions = 0
+        self.baseline_rss = None
+        self._last_rss_check = 0.0
+        self._lock = threading.Lock()
+
+    def register(self, store: MemoryStore):
+        with self._lock:
+            if store.name in self.stores:
+                raise ValueError(f"Memory store '{store.name}' is already registered")
+            self.stores[store.name] = store
+        return store
+
+    def tracked_bytes(self):
+        return sum(store.used_bytes for store in list(self.stores.values()))
+
+    def budget_bytes(self):
+        return sum(store.budget_bytes for store in list(self.stores.values()))
+
+    def record_baseline(self):
+        """
+        Take the RSS baseline (interpreter, FastAPI, OpenAI client...). Call
+        once at startup, after all modules are imported and before traffic.
+        """
+        self.baseline_rss = _read_rss_bytes()
+        if self.baseline_rss is None:
+            return
+        if self.baseline_rss + self.budget_bytes() > self.target_bytes:
+            print(
+                f"Warning: baseline RSS ({self.baseline_rss} bytes) plus memory store budgets "
+                f"({self.budget_bytes()} bytes) exceed MEMORY_TARGET_BYTES ({self.target_bytes}); "
+                f"RSS will be held to {self.baseline_rss + self.budget_bytes()} bytes instead"
+            )
+
+    def enforce(self):
+        tracked = self.tracked_bytes()
+        overshoot = tracked - self.target_bytes
+
+        # RSS is only sampled once per interval, and only once a baseline
+        # was recorded at startup (see record_baseline). The caches can't do
+        # anything about the baseline, so RSS only counts as too high when it
+        # is over the target *and* over what the baseline plus full caches
+        # would explain. Freed memory is not always returned to the OS, so
+        # this trims at most half of what the stores hold per check and
+        # stops once they are nearly empty.
+        now = time.monotonic()
+        if self.baseline_rss is not None and now - self._last_rss_check >= RSS_CHECK_INTERVAL_SECONDS:
+            self._last_rss_check = now
+            rss = _read_rss_bytes()
+            if rss is not None and tracked > self.budget_bytes() // 16:
+                rss_limit = max(self.target_bytes, self.baseline_rss + self.budget_bytes())
+                if rss > rss_limit:
+                    overshoot = max(overshoot, min(rss - rss_limit, tracked // 2))
+        if overshoot <= 0:
+            return 0
+
+        freed = 0
+        with self._lock:
+            stores = sorted(
+                self.stores.values(),
+                key=lambda s: s.used_bytes / max(s.budget_bytes, 1),
+                reverse=True,
+            )
+            for store in stores:
+                if freed >= overshoot:
+                    break
+                freed += store.evict_bytes(overshoot - freed)
+            self.forced_evictions += 1
+        return freed
+
+    def stats(self):
+        return {
+            "target_bytes": self.target_bytes,
+            "tracked_bytes": self.tracked_bytes(),
+            "rss_bytes": _read_rss_bytes(),
+            "baseline_rss_bytes": self.baseline_rss,
+            "forced_evictions": self.forced_evictions,
+            "stores": [store.stats() for store in list(self.stores.values())],
+        }
+
+
+coordinator = EvictionCoordinator(MEMORY_TARGET_BYTES)
+
+
+def create_store(name: str, budget_bytes: Optional[int] = None, ttl_seconds: Optional[float] = None):
+    """
+    Create a store registered with the global coordinator.
+    The budget can be overridden per store with MEMORY_BUDGET_<NAME> (bytes).
+    """
+    env_budget = os.getenv(f"MEMORY_BUDGET_{name.upper()}")
+    if env_budget:
+        budget_bytes = int(env_budget)
+    elif budget_bytes is None:
+        budget_bytes = DEFAULT_STORE_BUDGET_BYTES
+    store = coordinator.register(MemoryStore(name, budget_bytes, ttl_seconds))
+    if coordinator.budget_bytes() > coordinator.target_bytes:
+        print(
+            f"Warning: memory store budgets add up to {coordinator.budget_bytes()} bytes, "
+            f"more than MEMORY_TARGET_BYTES ({coordinator.target_bytes})"
+        )
+    return store
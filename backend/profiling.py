@@ -0,0 +1,257 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+
+# Profiling settings
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))  # fraction of requests to sample
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "100"))
+
+MAX_STACK_DEPTH = 64
+MAX_DISTINCT_STACKS = 5000
+TRUNCATED_STACK = (("[truncated]", "", 0),)
+
+
+def _capture_stack(frame):
+    """Root-first tuple of (function, file, first line) for a frame chain."""
+    stack = []
+    while frame is not None and len(stack) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _is_idle(stack):
+    """The loop is waiting in its selector poll, not running any callback."""
+    _, filename, _ = stack[-1]
+    return os.path.basename(filename) == "selectors.py"
+
+
+def _frame_label(frame):
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})" if filename else name
+
+
+def to_folded(stacks):
+    """Collapsed stack lines ("a;b;c count"), the input format of flamegraph.pl and friends."""
+    lines = [
+        ";".join(_frame_label(frame) for frame in stack) + f" {count}"
+        for stack, count in sorted(stacks.items(), key=lambda item: -item[1])
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def to_speedscope(stacks, interval_seconds: float, name: str):
+    """Sampled profile in speedscope's file format (https://www.speedscope.app)."""
+    frames = []
+    frame_index = {}
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        sample = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                func, filename, line = frame
+                frames.append({"name": func, "file": filename, "line": line})
+            sample.append(frame_index[frame])
+        samples.append(sample)
+        weights.append(count * interval_seconds)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }
+        ],
+        "name": name,
+        "activeProfileIndex": 0,
+        "exporter": "e-compare",
+    }
+
+
+class LoopProfiler:
+    """
+    Statistical profiler for the event loop thread.
+
+    A background thread periodically grabs the loop thread's current stack
+    with sys._current_frames() while a sampled request or an on-demand
+    capture is in flight, so requests that aren't sampled pay nothing.
+    The same thread doubles as a watchdog: a heartbeat task on the loop
+    measures scheduling lag, and when the heartbeat goes stale the stack of
+    whatever is blocking the loop is recorded as a slow callback, with its
+    final duration filled in once the loop gets back to the heartbeat.
+    Samples taken while the loop is idle in its selector poll are only
+    counted, not kept as stacks, so flame graphs show real work.
+    """
+
+    def __init__(self):
+        self.sample_rate = PROFILE_SAMPLE_RATE
+        self.interval = PROFILE_SAMPLE_INTERVAL_MS / 1000
+        self.lag_interval = LOOP_LAG_INTERVAL_MS / 1000
+        self.slow_threshold = SLOW_CALLBACK_MS / 1000
+
+        self.loop_thread_id = None
+        self.sampled_stacks = {}
+        self.sampled_requests = 0
+        self.idle_samples = 0
+        self.slow_callbacks = deque(maxlen=50)
+        self.lag_samples = deque(maxlen=600)
+        self.max_lag = 0.0
+
+        self._active_requests = 0
+        self._captures = []
+        self._heartbeat = time.monotonic()
+        self._open_stall = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lag_task = None
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-profiler", daemon=True)
+        self._thread.start()
+        self._lag_task = asyncio.get_running_loop().create_task(self._measure_lag())
+
+    def stop(self):
+        self._stop.set()
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+
+    # Request sampling
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def request_started(self):
+        with self._lock:
+            self._active_requests += 1
+            self.sampled_requests += 1
+
+    def request_finished(self):
+        with self._lock:
+            self._active_requests -= 1
+
+    def take_samples(self, reset: bool = False):
+        with self._lock:
+            stacks = dict(self.sampled_stacks)
+            if reset:
+                self.sampled_stacks = {}
+                self.sampled_requests = 0
+                self.idle_samples = 0
+        return stacks
+
+    # On-demand capture
+    async def capture(self, seconds: float):
+        stacks = {}
+        with self._lock:
+            self._captures.append(stacks)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            with self._lock:
+                self._captures.remove(stacks)
+        return stacks
+
+    def stats(self):
+        lags = sorted(self.lag_samples)
+        last_lag = self.lag_samples[-1] if lags else 0.0
+        with self._lock:
+            distinct_stacks = len(self.sampled_stacks)
+            total_samples = sum(self.sampled_stacks.values())
+        return {
+            "sample_rate": self.sample_rate,
+            "sample_interval_ms": self.interval * 1000,
+            "sampled_requests": self.sampled_requests,
+            "samples": total_samples,
+            "idle_samples": self.idle_samples,
+            "distinct_stacks": distinct_stacks,
+            "loop_lag_ms": {
+                "last": last_lag * 1000,
+                "p50": lags[len(lags) // 2] * 1000 if lags else 0.0,
+                "p99": lags[int(len(lags) * 0.99)] * 1000 if lags else 0.0,
+                "max": self.max_lag * 1000,
+            },
+            "slow_callbacks": list(self.slow_callbacks),
+        }
+
+    async def _measure_lag(self):
+        while True:
+            expected = time.monotonic() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0.0)
+            self.lag_samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            with self._lock:
+                self._heartbeat = now
+                stall, self._open_stall = self._open_stall, None
+            if stall is not None:
+                stall["blocked_ms"] = round(lag * 1000, 1)
+                stall["ongoing"] = False
+                print(f"Event loop blocked for {lag * 1000:.0f}ms in {stall['stack'][-1]}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                targets = list(self._captures)
+                if self._active_requests > 0:
+                    targets.append(self.sampled_stacks)
+
+            with self._lock:
+                stalled_for = time.monotonic() - self._heartbeat - self.lag_interval
+                stalled = stalled_for > self.slow_threshold and self._open_stall is None
+
+            if targets or stalled:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = _capture_stack(frame) if frame is not None else None
+                if stack:
+                    if targets:
+                        self._record(targets, stack)
+                    if stalled:
+                        # blocked_ms is updated by _measure_lag when the loop resumes
+                        stall = {
+                            "detected_at": time.time(),
+                            "blocked_ms": round(stalled_for * 1000, 1),
+                            "ongoing": True,
+                            "stack": [_frame_label(f) for f in stack],
+                        }
+                        with self._lock:
+                            self._open_stall = stall
+                            self.slow_callbacks.append(stall)
+
+            time.sleep(self.interval if targets else self.lag_interval / 2)
+
+    def _record(self, targets, stack):
+        with self._lock:
+            if _is_idle(stack):
+                if any(stacks is self.sampled_stacks for stacks in targets):
+                    self.idle_samples += 1
+                return
+            for stacks in targets:
+                if stack not in stacks and len(stacks) >= MAX_DISTINCT_STACKS:
+                    key = TRUNCATED_STACK
+                else:
+                    key = stack
+                stacks[key] = stacks.get(key, 0) + 1
+
+
+profiler = LoopProfiler()
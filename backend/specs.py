@@ -0,0 +1,261 @@
+import re
+import json
+import html
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from memory_store import create_store
+
+# Normalized spec vectors, keyed by product id (see normalize_product).
+# Same TTL as the product details cache so prices don't go stale.
+spec_cache = create_store("specs", budget_bytes=16 * 1024 * 1024, ttl_seconds=600)
+
+MAX_INDEXED_CATEGORIES = 500
+
+TAG_RE = re.compile(r"<[^>]+>")
+SPACE_RE = re.compile(r"\s+")
+# Tiki writes "5.000 mAh" / "1.000.000": a separator followed by exactly three
+# digits may be digit grouping, anything else ("6,1 inch", "2.45 GHz") is a
+# decimal. Grouping is only trusted for GROUPING_UNITS (see parse_value).
+NUMBER_UNIT_RE = re.compile(
+    r"^(?:(?P<grouped>[1-9]\d{0,2}(?:[.,]\d{3})+)|(?P<decimal>\d+(?:[.,]\d+)?))"
+    r"\s*(?P<unit>[a-zA-Zµ\"”]+)?\.?$"
+)
+
+# Units whose values are large counts, so "5.000 mAh" can only mean 5000.
+# For the rest "2.450 GHz" / "1.250 kg" are decimals.
+GROUPING_UNITS = {"", "mah", "px", "nits"}
+
+TRUE_VALUES = {"có", "co", "yes", "true"}
+FALSE_VALUES = {"không", "khong", "no", "false"}
+
+# unit -> (canonical unit, factor to convert into it)
+UNITS = {
+    "mm": ("mm", 1), "cm": ("mm", 10), "m": ("mm", 1000),
+    "inch": ("inch", 1), "in": ("inch", 1), "\"": ("inch", 1), "”": ("inch", 1),
+    "g": ("g", 1), "gr": ("g", 1), "gram": ("g", 1), "kg": ("g", 1000),
+    "mb": ("GB", 1 / 1024), "gb": ("GB", 1), "tb": ("GB", 1024),
+    "hz": ("Hz", 1), "khz": ("Hz", 1e3), "mhz": ("Hz", 1e6), "ghz": ("Hz", 1e9),
+    "mah": ("mAh", 1), "wh": ("Wh", 1),
+    "w": ("W", 1), "kw": ("W", 1000),
+    "v": ("V", 1), "l": ("L", 1), "ml": ("L", 1 / 1000),
+    "mp": ("MP", 1), "px": ("px", 1), "nits": ("nits", 1),
+}
+
+
+def normalize_key(text: str):
+    """ "Kích thước màn hình" -> "kich_thuoc_man_hinh" """
+    text = unicodedata.normalize("NFKD", text.replace("đ", "d").replace("Đ", "D"))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return re.sub(r"[^a-z0-9]+", "_", text).strip("_")
+
+
+def clean_text(value):
+    text = html.unescape(TAG_RE.sub(" ", str(value)))
+    return SPACE_RE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def parse_value(raw):
+    """
+    Turn a raw Tiki attribute value into a typed attribute:
+    {"type": "number", "value": 6.1, "unit": "inch"}, {"type": "bool", "value": True}
+    or {"type": "text", "value": "..."}. The cleaned original is kept in
+    "text" for display; type, value and unit are what gets compared.
+
+    >>> parse_value("5.000 mAh")["value"], parse_value("1.000.000")["value"]
+    (5000.0, 1000000.0)
+    >>> parse_value("6,1 inch")["value"], parse_value("2.450 GHz")["value"]
+    (6.1, 2450000000.0)
+    >>> parse_value("1.250 kg")["value"], parse_value("1.250.000 kg")["type"]
+    (1250.0, 'text')
+    >>> parse_value("0.125 TB")["value"], parse_value("512 MB")["text"]
+    (128.0, '512 MB')
+    """
+    text = clean_text(raw)
+    lowered = text.lower()
+
+    if lowered in TRUE_VALUES:
+        return {"type": "bool", "value": True, "text": text}
+    if lowered in FALSE_VALUES:
+        return {"type": "bool", "value": False, "text": text}
+
+    match = NUMBER_UNIT_RE.match(text)
+    if match:
+        unit = (match.group("unit") or "").lower()
+        grouped = match.group("grouped")
+        if grouped and unit in GROUPING_UNITS:
+            number = float(re.sub(r"[.,]", "", grouped))
+        elif grouped and len(re.findall(r"[.,]", grouped)) == 1:
+            number = float(grouped.replace(",", "."))
+        elif grouped:
+            # "1.250.000 kg": not a sensible amount either way
+            return {"type": "text", "value": text, "text": text}
+        else:
+            number = float(match.group("decimal").replace(",", "."))
+
+        if not unit:
+            return {"type": "number", "value": number, "text": text}
+        if unit in UNITS:
+            canonical, factor = UNITS[unit]
+            return {"type": "number", "value": round(number * factor, 6), "unit": canonical, "text": text}
+
+    return {"type": "text", "value": text, "text": text}
+
+
+def content_hash(specifications):
+    payload = json.dumps(specifications, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()
+
+
+def normalize_specifications(specifications):
+    """
+    Flatten Tiki specifications[].attributes[] into an ordered attribute
+    vector. Keys are always the slugified attribute name, since Tiki only
+    sends a code for some attributes on some products; the code is used only
+    when the name is missing. The first occurrence of a key wins.
+    """
+    attributes = {}
+    for group in specifications or []:
+        if not isinstance(group, dict):
+            continue
+        for attr in group.get("attributes") or []:
+            if not isinstance(attr, dict):
+                continue
+            label = clean_text(attr.get("name") or "")
+            key = normalize_key(label or attr.get("code") or "")
+            if not key or key in attributes or attr.get("value") in (None, ""):
+                continue
+            parsed = parse_value(attr["value"])
+            parsed["label"] = label or attr["code"]
+            attributes[key] = parsed
+    return attributes
+
+
+class CategoryIndex:
+    """
+    Attribute keys seen per category, in first-seen order. Lets products of
+    one category be diffed on a shared, stable attribute order. Least recently updated categories are dropped
+    once MAX_INDEXED_CATEGORIES is reached.
+    """
+
+    def __init__(self, max_categories: int):
+        self.max_categories = max_categories
+        self._categories = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, category_id, attribute_keys):
+        if category_id is None:
+            return
+        with self._lock:
+            entry = self._categories.get(category_id)
+            if entry is None:
+                entry = {}
+                self._categories[category_id] = entry
+                if len(self._categories) > self.max_categories:
+                    self._categories.popitem(last=False)
+            self._categories.move_to_end(category_id)
+            for key in attribute_keys:
+                entry.setdefault(key, len(entry))
+
+    def key_order(self, category_id):
+        with self._lock:
+            entry = self._categories.get(category_id)
+            return dict(entry) if entry else {}
+
+
+category_index = CategoryIndex(MAX_INDEXED_CATEGORIES)
+
+
+def normalize_product(product_id: int, data: dict):
+    """
+    Normalized record for a raw Tiki product payload. Specs are only parsed
+    again when their content hash changes; name, price and category are
+    always taken from the latest payload.
+    """
+    specifications = data.get("specifications")
+    if not isinstance(specifications, list):
+        specifications = []
+    spec_hash = content_hash(specifications)
+    category = data.get("categories")
+    if not isinstance(category, dict):
+        category = {}
+    details = {
+        "id": product_id,
+        "name": data.get("name"),
+        "price": data.get("price"),
+        "category_id": category.get("id"),
+    }
+
+    cached = spec_cache.get(str(product_id))
+    if cached is not None and cached["hash"] == spec_hash:
+        if all(cached[field] == value for field, value in details.items()):
+            return cached
+        record = {**cached, **details}
+    else:
+        record = {**details, "hash": spec_hash, "attributes": normalize_specifications(specifications)}
+
+    spec_cache.set(str(product_id), record)
+    category_index.add(record["category_id"], record["attributes"].keys())
+    return record
+
+
+def get_cached_product(product_id: int) -> Optional[dict]:
+    return spec_cache.get(str(product_id))
+
+
+def _format_value(attr):
+    return attr["text"] if attr is not None else None
+
+
+def diff_products(records):
+    """
+    Attributes whose values differ between the given normalized products.
+    An attribute missing on some products counts as a difference.
+    """
+    category_ids = {record["category_id"] for record in records}
+    same_category = len(category_ids) == 1 and None not in category_ids
+
+    order = category_index.key_order(next(iter(category_ids))) if same_category else {}
+    all_keys = {}
+    for record in records:
+        for key in record["attributes"]:
+            all_keys.setdefault(key, len(all_keys))
+    keys = sorted(all_keys, key=lambda k: (order.get(k, len(order)), all_keys[k]))
+
+    differences = []
+    shared_count = 0
+    for key in keys:
+        attrs = [record["attributes"].get(key) for record in records]
+        comparable = {(a["type"], a["value"], a.get("unit")) if a else None for a in attrs}
+        if len(comparable) == 1:
+            shared_count += 1
+            continue
+        label = next(a["label"] for a in attrs if a)
+        differences.append({
+            "key": key,
+            "label": label,
+            "values": [_format_value(a) for a in attrs],
+        })
+
+    return {
+        "products": [
+            {"id": r["id"], "name": r["name"], "price": r["price"], "category_id": r["category_id"]}
+            for r in records
+        ],
+        "same_category": same_category,
+        "differences": differences,
+        "shared_count": shared_count,
+    }
+
+
+def diff_to_prompt(diff):
+    """Compact comparison input for the LLM built from the diff only."""
+    lines = []
+    for index, product in enumerate(diff["products"]):
+        lines.append(f"Product {index + 1}: {product['name']} - Price: {product['price']}")
+    for difference in diff["differences"]:
+        values = " | ".join(v if v is not None else "-" for v in difference["values"])
+        lines.append(f"{difference['label']}: {values}")
+    return "\n".join(lines)